@@ -27,4 +27,9 @@ def get_rates_for_date(target_date: date) -> dict:
     
     if applicable_date:
         return ENERGY_RATES[applicable_date.isoformat()]
-    return None
\ No newline at end of file
+    return None
+
+# Off-peak window for the peak/off-peak tariff (local time, start inclusive, end exclusive).
+# Picked up without a restart by the dashboard and by LDR monitor v0.8 - v0.7 needs a restart.
+OFFPEAK_START_HOUR = 2
+OFFPEAK_END_HOUR = 9
@@ -0,0 +1,30 @@
+STORAGE_POLICY = {
+    # Durability vs wear: pulses are held in memory and written in one
+    # transaction at most this many seconds apart. With synchronous FULL a
+    # power cut loses at most this many seconds of pulses. Set to 0 to write
+    # every pulse immediately.
+    "max_pulse_loss_seconds": 30,
+
+    # PRAGMA synchronous - FULL syncs the WAL on every commit, i.e. once per
+    # flush above. NORMAL skips that sync, so a power cut can also roll back
+    # everything written since the last checkpoint (up to 15 minutes).
+    "synchronous": "FULL",
+
+    # Only applied when the database file is first created
+    "page_size": 4096,
+
+    # Safety net only - checkpoints are normally run by the scheduler below.
+    # Number of WAL pages before SQLite checkpoints on its own (0 disables).
+    "wal_autocheckpoint": 10000,
+
+    # Minutes past the hour to run a PASSIVE checkpoint. Kept clear of the
+    # hourly pulse update (15,30,45,59) so the two never run together.
+    "passive_checkpoint_minutes": "7,22,37,52",
+
+    # Hour (local time) of the nightly TRUNCATE checkpoint, inside the off-peak
+    # window when nobody is looking at the dashboard
+    "truncate_checkpoint_hour": 4,
+
+    # Warn once a day when this process has written more than this many bytes
+    "daily_write_budget_bytes": 8 * 1024 * 1024,
+}
@@ -0,0 +1,46 @@
+import os
+
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Any setting can be overridden with an environment variable named
+# ENERGY_MONITOR_<SETTING>, e.g. ENERGY_MONITOR_DB_PATH=/data/energy.db
+WEB_CONFIG = {
+    # SQLite database written by the LDR monitor
+    "db_path": os.path.join(os.path.dirname(CONFIG_DIR), "energy.db"),
+
+    # Timezone used for 'localtime' in queries (days, peak/off-peak hours)
+    "timezone": "Europe/London",
+
+    # Tariff file - reloaded without a restart when it changes
+    "rates_file": os.path.join(CONFIG_DIR, "energy_rates.py"),
+
+    # Seconds between checks for a changed rates_file
+    "rates_check_seconds": 10,
+
+    # Days (before today) to compute when a worker starts
+    "warm_days": 14,
+
+    # Seconds today's page data is reused before being recomputed.
+    # Past days are reused until midnight or a tariff change.
+    "today_cache_seconds": 60,
+
+    # Days cached beyond today and warm_days - least recently viewed are
+    # dropped first, so browsing through dates can't use unbounded memory
+    "cache_extra_days": 10,
+
+    # Only for the development server
+    "debug": False,
+}
+
+def load_config():
+    """WEB_CONFIG with any ENERGY_MONITOR_<SETTING> environment overrides applied"""
+    config = {}
+    for key, default in WEB_CONFIG.items():
+        value = os.environ.get(f"ENERGY_MONITOR_{key.upper()}")
+        if value is None:
+            config[key] = default
+        elif isinstance(default, bool):
+            config[key] = value.lower() in ('1', 'true', 'yes')
+        else:
+            config[key] = type(default)(value)
+    return config
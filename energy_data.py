@@ -0,0 +1,339 @@
+'''
+Energy Data
+Queries behind the dashboard page, shared by web_view.py and the LDR monitor.
+
+The monitor stores the result for today (and for each day as it finishes) in the
+dashboard_snapshots table as a compressed blob, so a page view reads one row
+instead of running the queries and cost calculations. For a day still in progress
+only the minute series and daily statistics are brought up to date at page time,
+from the pulses recorded since the snapshot and the daily_stats row.
+'''
+
+import sqlite3
+from datetime import datetime
+import hashlib
+import importlib.util
+import json
+import zlib
+from energy_stats import offpeak_hours
+
+SNAPSHOT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS dashboard_snapshots(
+        day DATE PRIMARY KEY,
+        watermark INTEGER,
+        pulse_watermark INTEGER,
+        rates_version TEXT,
+        data BLOB,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )"""
+
+# Shared by the page query and the live daily statistics of an unfinished snapshot
+DAILY_STATS_JSON = """
+    SELECT json_object(
+               'baseload_kw', baseload_kw, 'baseload_start', baseload_start,
+               'peak_demand_kw', peak_demand_kw, 'peak_demand_start', peak_demand_start,
+               'peak_pulses', peak_pulses, 'off_peak_pulses', off_peak_pulses,
+               'avg_1m_kw', avg_1m_kw, 'avg_5m_kw', avg_5m_kw, 'avg_30m_kw', avg_30m_kw,
+               'updated_at', updated_at) as stats
+    FROM daily_stats
+    WHERE day = ?"""
+
+def pulses_to_kwh(pulses):
+    return pulses / 3200
+
+def offpeak_bounds(rates=None):
+    """Off-peak hours of a loaded tariff module, as compared against
+    strftime('%H', ...) in the queries below"""
+    start, end = offpeak_hours(rates)
+    return f"{start:02d}", f"{end:02d}"
+
+def get_daily_energy_split(cursor, start_date, days_back=7, rates=None):
+    """Get daily energy split between peak and off-peak hours"""
+    OFFPEAK_START, OFFPEAK_END = offpeak_bounds(rates)
+    cursor.execute(f"""
+        SELECT 
+            strftime('%Y-%m-%d', hour_timestamp, 'localtime') as day,
+            SUM(CASE 
+                WHEN strftime('%H', hour_timestamp, 'localtime') >= '{OFFPEAK_START}' 
+                AND strftime('%H', hour_timestamp, 'localtime') < '{OFFPEAK_END}' 
+                THEN pulse_count ELSE 0 END) as off_peak_pulses,
+            SUM(CASE 
+                WHEN strftime('%H', hour_timestamp, 'localtime') < '{OFFPEAK_START}' 
+                OR strftime('%H', hour_timestamp, 'localtime') >= '{OFFPEAK_END}' 
+                THEN pulse_count ELSE 0 END) as peak_pulses
+        FROM hourly_pulses
+        WHERE date(hour_timestamp, 'localtime') 
+            BETWEEN date(?, ?) AND date(?)
+        GROUP BY day
+        ORDER BY day
+    """, (start_date, f'-{days_back} days', start_date))
+    
+    # Convert pulse counts to kWh before returning
+    raw_data = cursor.fetchall()
+    return [(day, pulses_to_kwh(off_peak), pulses_to_kwh(peak)) 
+            for day, off_peak, peak in raw_data]
+
+def stats_with_kwh(daily_stats):
+    """A daily_stats row with its pulse counts also converted to kWh for display"""
+    daily_stats['peak_kwh'] = pulses_to_kwh(daily_stats['peak_pulses'] or 0)
+    daily_stats['off_peak_kwh'] = pulses_to_kwh(daily_stats['off_peak_pulses'] or 0)
+    return daily_stats
+
+def get_all_energy_data(start_date, db_path, rates):
+    conn = sqlite3.connect(db_path)
+    try:
+        return query_energy_data(conn.cursor(), start_date, rates)
+    finally:
+        conn.close()
+
+def query_energy_data(cursor, start_date, rates, max_pulse_id=None):
+    """Minute, hourly and daily data with costs for the dashboard page of start_date,
+    using the tariffs and off-peak hours of a loaded tariff module. The minute series
+    can be limited to pulses up to max_pulse_id."""
+    if not start_date:
+        start_date = datetime.now().strftime('%Y-%m-%d')
+    OFFPEAK_START, OFFPEAK_END = offpeak_bounds(rates)
+
+    # Get minute data, hourly data, date range, and daily split in one connection
+    cursor.execute(f"""
+        WITH minute_data AS (
+            SELECT strftime('%Y-%m-%d %H:%M', timestamp, 'localtime') as minute,
+                   COUNT(*) as pulse_count
+            FROM pulses
+            WHERE date(timestamp, 'localtime') = ? AND (? IS NULL OR id <= ?)
+            GROUP BY minute
+        ),
+        hourly_data AS (
+            SELECT strftime('%Y-%m-%d %H:00', hour_timestamp, 'localtime') as hour,
+                   pulse_count
+            FROM hourly_pulses
+            WHERE date(hour_timestamp, 'localtime') BETWEEN date(?, '-6 days') AND date(?)
+        ),
+        date_range AS (
+            SELECT MIN(date(timestamp)) as min_date, 
+                   MAX(date(timestamp)) as max_date 
+            FROM pulses
+        ),
+        stats_data AS ({DAILY_STATS_JSON}
+        )
+        SELECT 
+            'minute' as type, minute as timestamp, pulse_count, NULL, NULL, NULL
+        FROM minute_data
+        UNION ALL
+        SELECT 
+            'hour' as type, hour, pulse_count, NULL, NULL, NULL
+        FROM hourly_data
+        UNION ALL
+        SELECT 
+            'range' as type, NULL, NULL, NULL, NULL, 
+            json_object('min', min_date, 'max', max_date)
+        FROM date_range
+        UNION ALL
+        SELECT
+            'stats' as type, NULL, NULL, NULL, NULL, stats
+        FROM stats_data;
+    """, (start_date, max_pulse_id, max_pulse_id, start_date, start_date, start_date))
+    
+    results = cursor.fetchall()
+    
+    # Get daily split using shared function - but extend it to get 7 days for detailed data
+    daily_split = get_daily_energy_split(cursor, start_date, 13, rates)
+    
+    # Get detailed daily data with costs (7 days from start_date)
+    cursor.execute(f"""
+        SELECT 
+            strftime('%Y-%m-%d', hour_timestamp, 'localtime') as day,
+            SUM(CASE 
+                WHEN strftime('%H', hour_timestamp, 'localtime') >= '{OFFPEAK_START}' 
+                AND strftime('%H', hour_timestamp, 'localtime') < '{OFFPEAK_END}' 
+                THEN pulse_count ELSE 0 END) as off_peak_pulses,
+            SUM(CASE 
+                WHEN strftime('%H', hour_timestamp, 'localtime') < '{OFFPEAK_START}' 
+                OR strftime('%H', hour_timestamp, 'localtime') >= '{OFFPEAK_END}' 
+                THEN pulse_count ELSE 0 END) as peak_pulses,
+            SUM(pulse_count) as total_pulses
+        FROM hourly_pulses
+        WHERE date(hour_timestamp, 'localtime') 
+            BETWEEN date(?, '-13 days') AND date(?)
+        GROUP BY day
+        ORDER BY day
+    """, (start_date, start_date))
+    
+    detailed_daily_data = cursor.fetchall()
+
+    # Process results
+    minute_data = []
+    hourly_data = []
+    date_range = None
+    daily_stats = None
+
+    for row in results:
+        if row[0] == 'minute':
+            minute_data.append((row[1], row[2]))
+        elif row[0] == 'hour':
+            hourly_data.append((row[1], row[2]))
+        elif row[0] == 'range':
+            date_range = json.loads(row[5])
+        elif row[0] == 'stats':
+            daily_stats = stats_with_kwh(json.loads(row[5]))
+
+    # Process detailed daily data with cost calculations
+    consolidated_data = []
+    for day_data in detailed_daily_data:
+        day, off_peak_pulses, peak_pulses, total_pulses = day_data
+        
+        # Get applicable rates for this day
+        date_obj = datetime.strptime(day, '%Y-%m-%d').date()
+        day_rates = rates.get_rates_for_date(date_obj)
+        
+        # Calculate kWh values
+        off_peak_kwh = pulses_to_kwh(off_peak_pulses)
+        peak_kwh = pulses_to_kwh(peak_pulses)
+        total_kwh = pulses_to_kwh(total_pulses)
+        
+        # Standard rate calculations
+        standard_cost = (total_kwh * day_rates['standard']['unit_rate']/100) + (day_rates['standard']['standing_charge']/100)
+        
+        # EV Anytime calculations
+        ev_anytime_cost = (total_kwh * day_rates['ev_anytime']['unit_rate']/100) + (day_rates['ev_anytime']['standing_charge']/100)
+        
+        # Peak/Off-peak calculations
+        off_peak_cost = off_peak_kwh * day_rates['peak_offpeak']['offpeak_rate']/100
+        peak_cost = peak_kwh * day_rates['peak_offpeak']['peak_rate']/100
+        ev_day_night_cost = off_peak_cost + peak_cost + (day_rates['peak_offpeak']['standing_charge']/100)
+        
+        consolidated_data.append({
+            'date': day,
+            'off_peak_kwh': off_peak_kwh,
+            'peak_kwh': peak_kwh,
+            'standard_cost': standard_cost,
+            'ev_anytime_cost': ev_anytime_cost,
+            'ev_day_night_cost': ev_day_night_cost
+        })
+
+    return {
+        'minute_data': minute_data,
+        'minute_kwh': [(m[0], pulses_to_kwh(m[1])) for m in minute_data],
+        'hourly_data': hourly_data,
+        'hourly_kwh': [(h[0], pulses_to_kwh(h[1])) for h in hourly_data],
+        'daily_peak_split': daily_split,
+        'date_range': (date_range['min'], date_range['max']),
+        'consolidated_data': consolidated_data,  # Add this to the return
+        'daily_stats': daily_stats
+    }
+
+def create_snapshot_table(conn):
+    """Create the dashboard_snapshots table if it doesn't exist"""
+    conn.execute(SNAPSHOT_SCHEMA)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(dashboard_snapshots)")]
+    if 'pulse_watermark' not in columns:
+        # Tables created before the minute series was brought up to date at page time
+        conn.execute("ALTER TABLE dashboard_snapshots ADD COLUMN pulse_watermark INTEGER")
+
+def load_rates(rates_file):
+    """Import the tariff file - returns a module providing get_rates_for_date()"""
+    spec = importlib.util.spec_from_file_location("energy_rates", rates_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def rates_version(rates, timezone):
+    """Short hash of everything a snapshot depends on besides the pulse data - the
+    tariffs, the off-peak hours and the timezone used for 'localtime'.
+    Snapshots with a different version are ignored."""
+    encoded = json.dumps({
+        'rates': rates.ENERGY_RATES,
+        'offpeak': list(offpeak_hours(rates)),
+        'timezone': timezone,
+    }, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:12]
+
+def rollup_watermark(cursor):
+    """Latest hourly_pulses row - increases every time the hourly rollup runs"""
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM hourly_pulses")
+    return cursor.fetchone()[0]
+
+def pulse_watermark(cursor):
+    """Latest pulses row - the minute series of a snapshot covers pulses up to here"""
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM pulses")
+    return cursor.fetchone()[0]
+
+def unfinished_snapshot_days(cursor, today):
+    """Days before today whose snapshot was taken before the day had ended"""
+    cursor.execute("""
+        SELECT day FROM dashboard_snapshots
+        WHERE day < ? AND date(created_at, 'localtime') <= day
+        ORDER BY day
+    """, (today,))
+    return [row[0] for row in cursor.fetchall()]
+
+def refresh_snapshot(conn, day, rates, version, final=False):
+    """Rebuild the snapshot for day unless it is already at the current watermark and
+    tariffs. final rebuilds it regardless, once the day has ended."""
+    cursor = conn.cursor()
+    watermark = rollup_watermark(cursor)
+    if not final:
+        cursor.execute("SELECT watermark, rates_version FROM dashboard_snapshots WHERE day = ?", (day,))
+        if cursor.fetchone() == (watermark, version):
+            return False
+
+    # Pulses flushed while the queries run are left to the page's live update
+    pulses = pulse_watermark(cursor)
+    data = query_energy_data(cursor, day, rates, max_pulse_id=pulses)
+    blob = zlib.compress(json.dumps(data, separators=(',', ':')).encode(), 9)
+    cursor.execute("""
+        INSERT OR REPLACE INTO dashboard_snapshots
+            (day, watermark, pulse_watermark, rates_version, data, created_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, (day, watermark, pulses, version, blob))
+    return True
+
+def update_unfinished_snapshot(cursor, day, data, pulses):
+    """Bring the minute series and daily statistics of a day still in progress up to
+    date - the pulses recorded since the snapshot and the current daily_stats row"""
+    cursor.execute("""
+        SELECT strftime('%Y-%m-%d %H:%M', timestamp, 'localtime') as minute,
+               COUNT(*) as pulse_count
+        FROM pulses
+        WHERE id > ? AND date(timestamp, 'localtime') = ?
+        GROUP BY minute
+    """, (pulses, day))
+    minute_counts = dict(data['minute_data'])
+    for minute, pulse_count in cursor.fetchall():
+        minute_counts[minute] = minute_counts.get(minute, 0) + pulse_count
+    data['minute_data'] = sorted(minute_counts.items())
+    data['minute_kwh'] = [(m[0], pulses_to_kwh(m[1])) for m in data['minute_data']]
+
+    cursor.execute(DAILY_STATS_JSON, (day,))
+    row = cursor.fetchone()
+    data['daily_stats'] = stats_with_kwh(json.loads(row[0])) if row else None
+    return data
+
+def load_snapshot(db_path, day, version):
+    """Dashboard data for day from its snapshot, or None if there isn't a current one.
+
+    A snapshot taken after the day ended is final. One taken during the day is only
+    used while it is at the current rollup watermark, so its hourly data, daily split
+    and costs are as current as the pulse tables; its minute series and daily
+    statistics are brought up to date with update_unfinished_snapshot()."""
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT data, watermark, pulse_watermark,
+                   date(created_at, 'localtime') > day as final
+            FROM dashboard_snapshots
+            WHERE day = ? AND rates_version = ?
+        """, (day, version))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        data, watermark, pulses, final = row
+        data = json.loads(zlib.decompress(data))
+        if not final:
+            if pulses is None or watermark != rollup_watermark(cursor):
+                return None
+            data = update_unfinished_snapshot(cursor, day, data, pulses)
+    finally:
+        conn.close()
+    return data
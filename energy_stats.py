@@ -0,0 +1,191 @@
+'''
+Streaming energy statistics
+Maintains running aggregates as pulses arrive, so baseload and peak demand
+questions never need a scan of the pulses table.
+
+Per pulse the work is constant (amortised for the rolling windows):
+-- rolling 1/5/30-minute average demand
+-- daily minimum half-hour demand (baseload)
+-- daily maximum half-hour demand
+-- daily pulses inside and outside the off-peak window
+'''
+
+from collections import deque
+from datetime import datetime
+import time
+from config.energy_rates import OFFPEAK_START_HOUR, OFFPEAK_END_HOUR
+
+PULSES_PER_KWH = 3200
+HALF_HOUR = 1800
+
+# Rolling window name -> length in seconds
+ROLLING_WINDOWS = {
+    "avg_1m_kw": 60,
+    "avg_5m_kw": 300,
+    "avg_30m_kw": 1800,
+}
+
+DAILY_STATS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS daily_stats(
+        day DATE PRIMARY KEY,
+        baseload_kw REAL,
+        baseload_start DATETIME,
+        peak_demand_kw REAL,
+        peak_demand_start DATETIME,
+        peak_pulses INTEGER DEFAULT 0,
+        off_peak_pulses INTEGER DEFAULT 0,
+        avg_1m_kw REAL,
+        avg_5m_kw REAL,
+        avg_30m_kw REAL,
+        updated_at DATETIME
+    )"""
+
+def create_stats_table(conn):
+    """Create the daily_stats table if it doesn't exist"""
+    conn.execute(DAILY_STATS_SCHEMA)
+
+def pulses_to_kw(pulses, seconds):
+    """Average demand in kW for a pulse count over a period"""
+    return (pulses / PULSES_PER_KWH) * 3600 / seconds
+
+def offpeak_hours(rates=None):
+    """(start, end) off-peak hours from a loaded tariff module, falling back to
+    the values in config/energy_rates.py"""
+    return (getattr(rates, 'OFFPEAK_START_HOUR', OFFPEAK_START_HOUR),
+            getattr(rates, 'OFFPEAK_END_HOUR', OFFPEAK_END_HOUR))
+
+def is_off_peak(local_time, hours=(OFFPEAK_START_HOUR, OFFPEAK_END_HOUR)):
+    """True if a local datetime falls inside the off-peak window"""
+    return hours[0] <= local_time.hour < hours[1]
+
+
+class StreamingStats:
+    """Running aggregates for the current day, updated one pulse at a time"""
+
+    def __init__(self):
+        self.windows = {name: deque() for name in ROLLING_WINDOWS}
+        self.day = None
+        self.slot_start = None
+        self.slot_pulses = 0
+        # The first half-hour after a (re)start is incomplete and would
+        # understate the baseload
+        self.slot_partial = True
+        self.completed_days = []
+        # Replaced when the monitor reloads the tariff file
+        self.offpeak_hours = offpeak_hours()
+        self._reset_day(None)
+
+    def _reset_day(self, day):
+        self.day = day
+        self.baseload_kw = None
+        self.baseload_start = None
+        self.peak_demand_kw = None
+        self.peak_demand_start = None
+        self.peak_pulses = 0
+        self.off_peak_pulses = 0
+
+    def load(self, row):
+        """Resume today's aggregates from a daily_stats row (as returned by to_row)"""
+        self.day = row['day']
+        self.baseload_kw = row['baseload_kw']
+        self.baseload_start = row['baseload_start']
+        self.peak_demand_kw = row['peak_demand_kw']
+        self.peak_demand_start = row['peak_demand_start']
+        self.peak_pulses = row['peak_pulses'] or 0
+        self.off_peak_pulses = row['off_peak_pulses'] or 0
+
+    def _close_slot(self):
+        """Fold the finished half-hour into the daily minimum and maximum"""
+        demand = pulses_to_kw(self.slot_pulses, HALF_HOUR)
+        start = datetime.fromtimestamp(self.slot_start).strftime('%Y-%m-%d %H:%M')
+        if not self.slot_partial and (self.baseload_kw is None or demand < self.baseload_kw):
+            self.baseload_kw = demand
+            self.baseload_start = start
+        if self.peak_demand_kw is None or demand > self.peak_demand_kw:
+            self.peak_demand_kw = demand
+            self.peak_demand_start = start
+        self.slot_pulses = 0
+        self.slot_partial = False
+
+    def tick(self, now=None):
+        """Advance the half-hour slot and expire rolling windows up to now (epoch seconds)"""
+        now = time.time() if now is None else now
+        slot = now - (now % HALF_HOUR)
+
+        if self.slot_start is None:
+            self.slot_start = slot
+            day = datetime.fromtimestamp(slot).strftime('%Y-%m-%d')
+            if self.day != day:
+                self._reset_day(day)
+
+        while self.slot_start < slot:
+            self._close_slot()
+            self.slot_start += HALF_HOUR
+            day = datetime.fromtimestamp(self.slot_start).strftime('%Y-%m-%d')
+            if day != self.day:
+                self.completed_days.append(self.to_row(now, include_rolling=False))
+                self._reset_day(day)
+
+        for name, seconds in ROLLING_WINDOWS.items():
+            window = self.windows[name]
+            while window and window[0] <= now - seconds:
+                window.popleft()
+
+    def add_pulse(self, now=None):
+        """Record one pulse at now (epoch seconds)"""
+        now = time.time() if now is None else now
+        self.tick(now)
+        for window in self.windows.values():
+            window.append(now)
+        self.slot_pulses += 1
+        if is_off_peak(datetime.fromtimestamp(now), self.offpeak_hours):
+            self.off_peak_pulses += 1
+        else:
+            self.peak_pulses += 1
+
+    def rolling_kw(self, name):
+        """Average demand over a rolling window, as of the last tick"""
+        return pulses_to_kw(len(self.windows[name]), ROLLING_WINDOWS[name])
+
+    def to_row(self, now=None, include_rolling=True):
+        """Current day's aggregates as a daily_stats row"""
+        now = time.time() if now is None else now
+        row = {
+            'day': self.day,
+            'baseload_kw': self.baseload_kw,
+            'baseload_start': self.baseload_start,
+            'peak_demand_kw': self.peak_demand_kw,
+            'peak_demand_start': self.peak_demand_start,
+            'peak_pulses': self.peak_pulses,
+            'off_peak_pulses': self.off_peak_pulses,
+            'updated_at': datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        for name in ROLLING_WINDOWS:
+            row[name] = self.rolling_kw(name) if include_rolling else None
+        return row
+
+
+def save_stats(cur, row):
+    """Insert or replace a daily_stats row"""
+    cur.execute("""
+        INSERT OR REPLACE INTO daily_stats (
+            day, baseload_kw, baseload_start, peak_demand_kw, peak_demand_start,
+            peak_pulses, off_peak_pulses, avg_1m_kw, avg_5m_kw, avg_30m_kw, updated_at)
+        VALUES (
+            :day, :baseload_kw, :baseload_start, :peak_demand_kw, :peak_demand_start,
+            :peak_pulses, :off_peak_pulses, :avg_1m_kw, :avg_5m_kw, :avg_30m_kw, :updated_at)
+    """, row)
+
+def load_stats(cur, day):
+    """Fetch a daily_stats row as a dict, or None"""
+    cur.execute("""
+        SELECT day, baseload_kw, baseload_start, peak_demand_kw, peak_demand_start,
+               peak_pulses, off_peak_pulses
+        FROM daily_stats WHERE day = ?
+    """, (day,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    keys = ('day', 'baseload_kw', 'baseload_start', 'peak_demand_kw',
+            'peak_demand_start', 'peak_pulses', 'off_peak_pulses')
+    return dict(zip(keys, row))
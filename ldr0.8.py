@@ -0,0 +1,456 @@
+'''
+LDR Energy Monitor
+A simple script to monitor light sensor pulses using GPIO on a Raspberry Pi.
+and store them in a local SQLite database.
+
+This script uses the gpiozero library to read from a light sensor connected to GPIO pin 24.
+It records the time of each pulse and stores it in a SQLite database.
+
+Change log: Version: 0.3
+-- Inserts a new pulse into the database each time light is detected.
+
+Change log: Version: 0.4
+-- added retry logic for database locking issues
+-- added creation of hourly_pulses table
+
+Change log: Version: 0.5
+-- Added automatic hourly pulse count updates
+-- Added threading to handle pulse updates without interrupting monitoring
+
+Change log: Version: 0.6
+-- Added storage policy (config/storage_policy.py) to reduce SD card wear
+-- Pulses are buffered in memory and flushed in one transaction every max_pulse_loss_seconds
+-- synchronous, wal_autocheckpoint and page_size are set from the storage policy
+-- Scheduled PASSIVE checkpoints and a nightly TRUNCATE checkpoint
+-- Bytes written per day are tracked in the storage_stats table
+
+Change log: Version: 0.7
+-- Added streaming statistics (energy_stats.py) updated as each pulse arrives
+-- Rolling 1/5/30-minute averages, daily baseload, peak half-hour demand and peak/off-peak pulses
+-- Statistics are saved to the daily_stats table in the same transaction as each pulse flush
+
+Change log: Version: 0.8
+-- Added dashboard snapshots (energy_data.py) so web_view.py reads one row per page
+-- Today's snapshot is rebuilt after each hourly pulse update, and each day is finalised after midnight
+   (or at the next start if the monitor was stopped); pages add the pulses recorded since
+-- Uses the dashboard's timezone and re-reads the tariff file (tariffs and off-peak hours)
+   for every snapshot update
+'''
+
+from gpiozero import LightSensor
+from datetime import datetime, timezone
+import sqlite3
+import os
+import time
+import threading
+from apscheduler.schedulers.background import BackgroundScheduler
+from config.storage_policy import STORAGE_POLICY
+from energy_stats import StreamingStats, create_stats_table, save_stats, load_stats, offpeak_hours
+from energy_data import (create_snapshot_table, refresh_snapshot, unfinished_snapshot_days,
+                         load_rates, rates_version)
+from config.web_config import load_config
+
+# Change GPIO Pin 24 to suit
+sensor = LightSensor(24, queue_len=1, threshold=0.01)
+verbose = 0
+version = "0.8"
+
+# Use the dashboard's timezone, so snapshot days and peak/off-peak hours match web_view.py
+MONITOR_TIMEZONE = load_config()['timezone']
+os.environ['TZ'] = MONITOR_TIMEZONE
+if hasattr(time, 'tzset'):
+    time.tzset()
+
+# Print startup information
+print(f" LDR Energy Monitor v{version}", flush=True)
+print(f" + Started [{datetime.now()}]", flush=True)
+print(f" + Using GPIO Pin: {sensor.pin.number}", flush=True)
+
+# Database path - store in same directory as script
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "energy_new.db")
+
+# Pulses waiting to be written, as UTC timestamps in the same format as CURRENT_TIMESTAMP
+pulse_buffer = []
+pulse_buffer_lock = threading.Lock()
+
+# Running statistics for today - guarded by pulse_buffer_lock
+stats = StreamingStats()
+stats_state = {"last_avg_30m_kw": 0}
+
+# Bytes written by this process, sampled from /proc/self/io.
+# "flushes" is shared with the flush job - guarded by pulse_buffer_lock
+write_tracker = {"last_sample": None, "warned_day": None, "flushes": 0}
+
+def connect_db(db_path, timeout=3):
+    """Open a connection with the per-connection storage policy pragmas applied"""
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    conn.execute(f"PRAGMA synchronous={STORAGE_POLICY['synchronous']}")
+    conn.execute(f"PRAGMA wal_autocheckpoint={int(STORAGE_POLICY['wal_autocheckpoint'])}")
+    return conn
+
+def create_local_db():
+    """Create SQLite Database if it doesn't exist"""
+    try:
+        conn = connect_db(DB_PATH)
+        curs = conn.cursor()
+
+        # Page size can only change before the database is created (or on VACUUM
+        # outside WAL mode), so this is a no-op for existing databases
+        curs.execute(f"PRAGMA page_size={int(STORAGE_POLICY['page_size'])}")
+
+        # Enable Write-Ahead Logging mode
+        curs.execute("PRAGMA journal_mode=WAL")
+
+        curs.execute("""
+            CREATE TABLE IF NOT EXISTS pulses(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )""")
+        curs.execute("""
+            CREATE TABLE IF NOT EXISTS hourly_pulses(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hour_timestamp DATETIME,
+                pulse_count INTEGER
+            )""")
+        curs.execute("""
+            CREATE TABLE IF NOT EXISTS storage_stats(
+                day DATE PRIMARY KEY,
+                bytes_written INTEGER DEFAULT 0,
+                flushes INTEGER DEFAULT 0,
+                checkpoints INTEGER DEFAULT 0
+            )""")
+        create_stats_table(conn)
+        create_snapshot_table(conn)
+
+        # Carry on from today's statistics after a restart
+        today = load_stats(curs, datetime.now().strftime('%Y-%m-%d'))
+        if today:
+            stats.load(today)
+        conn.commit()
+        print(f" + Database ready at {DB_PATH} [{datetime.now()}]", flush=True)
+        print(f" + Storage policy: flush every {STORAGE_POLICY['max_pulse_loss_seconds']}s, "
+              f"synchronous={STORAGE_POLICY['synchronous']}", flush=True)
+        return conn
+    except sqlite3.Error as e:
+        print(f" - Database Error: {e} [{datetime.now()}]", flush=True)
+        return None
+
+def store_pulse(conn, max_retries=3, retry_delay=0.1):
+    """Store a single pulse with retry logic for locked database"""
+    retries = 0
+    while retries < max_retries:
+        try:
+            # Set timeout to 5 seconds
+            conn = connect_db(DB_PATH, timeout=3)
+            curs = conn.cursor()
+            curs.execute("INSERT INTO pulses DEFAULT VALUES")
+            conn.commit()
+            if verbose > 0:
+                print(f" + Pulse recorded at {datetime.now()}", flush=True)
+            return True
+        except sqlite3.Error as e:
+            if "database is locked" in str(e):
+                retries += 1
+                if retries < max_retries:
+                    time.sleep(retry_delay)
+                    continue
+            print(f" - Error storing pulse: {e} [{datetime.now()}]", flush=True)
+            return False
+
+def record_pulse(conn):
+    """Record a pulse - buffered unless the storage policy asks for immediate writes"""
+    with pulse_buffer_lock:
+        stats.add_pulse()
+
+    if STORAGE_POLICY['max_pulse_loss_seconds'] <= 0:
+        return store_pulse(conn)
+
+    with pulse_buffer_lock:
+        pulse_buffer.append(datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+    if verbose > 0:
+        print(f" + Pulse buffered at {datetime.now()}", flush=True)
+    return True
+
+def flush_pulses(db_path, max_retries=3, retry_delay=0.1):
+    """Write all buffered pulses and the running statistics in a single transaction"""
+    with pulse_buffer_lock:
+        pending = pulse_buffer[:]
+        pulse_buffer.clear()
+        stats.tick()
+        stats_rows = stats.completed_days[:]
+        stats.completed_days.clear()
+        stats_rows.append(stats.to_row())
+
+    # Nothing new to say - skip the write unless the averages still need to decay to zero
+    if not pending and len(stats_rows) == 1 and not stats_state["last_avg_30m_kw"]:
+        return True
+
+    retries = 0
+    conn = None
+    while retries < max_retries:
+        try:
+            conn = connect_db(db_path)
+            cur = conn.cursor()
+            cur.executemany("INSERT INTO pulses (timestamp) VALUES (?)",
+                            [(ts,) for ts in pending])
+            for row in stats_rows:
+                save_stats(cur, row)
+            conn.commit()
+            stats_state["last_avg_30m_kw"] = stats_rows[-1]['avg_30m_kw']
+            with pulse_buffer_lock:
+                write_tracker["flushes"] += 1
+
+            if verbose > 0:
+                print(f" + Flushed {len(pending)} pulses [{datetime.now()}]", flush=True)
+            return True
+
+        except sqlite3.Error as e:
+            if "database is locked" in str(e):
+                retries += 1
+                if retries < max_retries:
+                    time.sleep(retry_delay)
+                    continue
+            # Keep the pulses for the next flush rather than dropping them
+            with pulse_buffer_lock:
+                pulse_buffer[:0] = pending
+                stats.completed_days[:0] = stats_rows[:-1]
+            print(f" - Error flushing pulses: {e} [{datetime.now()}]", flush=True)
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def read_process_write_bytes():
+    """Bytes this process has caused to be written to storage, or None if unavailable"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def record_storage_stats(cur, checkpoints=0):
+    """Add bytes written and flushes since the last sample to today's storage_stats row"""
+    day = datetime.now().strftime('%Y-%m-%d')
+    # The flush job runs on another scheduler thread
+    with pulse_buffer_lock:
+        flushes = write_tracker["flushes"]
+        write_tracker["flushes"] = 0
+    sample = read_process_write_bytes()
+    bytes_written = 0
+    if sample is not None and write_tracker["last_sample"] is not None:
+        bytes_written = max(sample - write_tracker["last_sample"], 0)
+    write_tracker["last_sample"] = sample
+
+    cur.execute("""
+        INSERT INTO storage_stats (day, bytes_written, flushes, checkpoints)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(day) DO UPDATE SET
+            bytes_written = bytes_written + excluded.bytes_written,
+            flushes = flushes + excluded.flushes,
+            checkpoints = checkpoints + excluded.checkpoints
+    """, (day, bytes_written, flushes, checkpoints))
+
+    cur.execute("SELECT bytes_written FROM storage_stats WHERE day = ?", (day,))
+    total = cur.fetchone()[0]
+    budget = STORAGE_POLICY['daily_write_budget_bytes']
+    if budget and total > budget and write_tracker["warned_day"] != day:
+        write_tracker["warned_day"] = day
+        print(f" - Write budget exceeded: {total} of {budget} bytes today "
+              f"(consider raising max_pulse_loss_seconds) [{datetime.now()}]", flush=True)
+    return total
+
+def checkpoint_wal(db_path, mode="PASSIVE"):
+    """Run a WAL checkpoint and record today's write statistics"""
+    conn = None
+    try:
+        conn = connect_db(db_path)
+        cur = conn.cursor()
+
+        # Record the stats first, so the checkpoint includes them and a
+        # TRUNCATE leaves the WAL empty
+        total = record_storage_stats(cur, checkpoints=1)
+        conn.commit()
+
+        cur.execute(f"PRAGMA wal_checkpoint({mode})")
+        busy, log_frames, checkpointed = cur.fetchone()
+
+        if verbose > 0:
+            print(f" + {mode} checkpoint: {checkpointed}/{log_frames} frames, busy={busy}, "
+                  f"{total} bytes written today [{datetime.now()}]", flush=True)
+        return True
+
+    except sqlite3.Error as e:
+        print(f" - Error running {mode} checkpoint: {e} [{datetime.now()}]", flush=True)
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def update_hourly_pulses(db_path, max_retries=3, retry_delay=0.1):
+    """Updates the hourly_pulses table with total pulse counts using UTC/GMT timestamps"""
+    # Make sure buffered pulses are counted
+    flush_pulses(db_path)
+
+    retries = 0
+    while retries < max_retries:
+        try:
+            conn = connect_db(db_path)
+            cur = conn.cursor()
+
+            current_time = datetime.now(timezone.utc)
+            current_hour = current_time.replace(minute=0, second=0, microsecond=0)
+
+            # First, delete any existing entries for the current hour
+            cur.execute("""
+                DELETE FROM hourly_pulses
+                WHERE hour_timestamp = ?
+            """, (current_hour.strftime('%Y-%m-%d %H:00:00'),))
+
+            # Then insert the new count
+            cur.execute("""
+                INSERT INTO hourly_pulses (hour_timestamp, pulse_count)
+                SELECT
+                    strftime('%Y-%m-%d %H:00:00', timestamp) as hour_timestamp,
+                    COUNT(*) as pulse_count
+                FROM pulses
+                WHERE strftime('%Y-%m-%d %H:00:00', timestamp) = ?
+                GROUP BY strftime('%Y-%m-%d %H:00:00', timestamp)
+            """, (current_hour.strftime('%Y-%m-%d %H:00:00'),))
+
+            conn.commit()
+
+            if verbose > 0:
+                print(f" + Updated hourly pulses at {current_time} UTC", flush=True)
+            return True
+
+        except sqlite3.Error as e:
+            if "database is locked" in str(e):
+                retries += 1
+                if retries < max_retries:
+                    time.sleep(retry_delay)
+                    continue
+            print(f" - Error updating hourly pulses: {e} [{datetime.now(timezone.utc)}]", flush=True)
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+def update_snapshots(db_path):
+    """Refresh today's dashboard snapshot, and finalise earlier days whose snapshot was
+    taken before they ended - after midnight, or after the monitor was stopped"""
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    # Re-read the tariffs each time, so an edit is picked up as it is by the dashboard
+    rates_file = load_config()['rates_file']
+    try:
+        rates = load_rates(rates_file)
+        version = rates_version(rates, MONITOR_TIMEZONE)
+    except Exception as e:
+        print(f" - Error loading tariffs from {rates_file}: {e} [{datetime.now()}]", flush=True)
+        return False
+
+    # Keep the streaming statistics on the same off-peak window as the snapshots
+    with pulse_buffer_lock:
+        stats.offpeak_hours = offpeak_hours(rates)
+
+    conn = None
+    try:
+        conn = connect_db(db_path)
+        for day in unfinished_snapshot_days(conn.cursor(), today):
+            refresh_snapshot(conn, day, rates, version, final=True)
+            if verbose > 0:
+                print(f" + Dashboard snapshot finalised for {day} [{datetime.now()}]", flush=True)
+        if refresh_snapshot(conn, today, rates, version) and verbose > 0:
+            print(f" + Dashboard snapshot updated for {today} [{datetime.now()}]", flush=True)
+        conn.commit()
+        return True
+
+    except sqlite3.Error as e:
+        print(f" - Error updating dashboard snapshot: {e} [{datetime.now()}]", flush=True)
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+def update_rollups(db_path):
+    """Hourly pulse counts first, then the dashboard snapshots built from them"""
+    if update_hourly_pulses(db_path):
+        update_snapshots(db_path)
+
+def start_scheduler(db_path):
+    """Starts the background scheduler for flushing, hourly pulse updates and checkpoints"""
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        lambda: update_rollups(db_path),
+        'cron',
+        minute='15,30,45,59'
+    )
+    # Pulses are written straight away when max_pulse_loss_seconds is 0,
+    # but statistics are still saved once a minute
+    scheduler.add_job(
+        lambda: flush_pulses(db_path),
+        'interval',
+        seconds=STORAGE_POLICY['max_pulse_loss_seconds'] or 60,
+        max_instances=1,
+        coalesce=True
+    )
+    scheduler.add_job(
+        lambda: checkpoint_wal(db_path, "PASSIVE"),
+        'cron',
+        minute=STORAGE_POLICY['passive_checkpoint_minutes']
+    )
+    scheduler.add_job(
+        lambda: checkpoint_wal(db_path, "TRUNCATE"),
+        'cron',
+        hour=STORAGE_POLICY['truncate_checkpoint_hour'],
+        minute=0
+    )
+    scheduler.start()
+    print(f" + Pulse flush, hourly update, snapshot and checkpoint scheduler started [{datetime.now()}]", flush=True)
+    return scheduler
+
+# Initialize database connection
+conn = create_local_db()
+if not conn:
+    print(" - Failed to initialize database. Exiting.", flush=True)
+    exit(1)
+
+# Baseline for the bytes-written counter
+write_tracker["last_sample"] = read_process_write_bytes()
+
+# Snapshot today straight away rather than waiting for the first hourly update, and
+# finalise any day that ended while the monitor was stopped
+update_snapshots(DB_PATH)
+
+# Start the scheduler
+scheduler = start_scheduler(DB_PATH)
+
+# Main loop
+try:
+    print(" + Monitoring light sensor (Ctrl+C to exit)...", flush=True)
+
+    while True:
+        current_value = sensor.value
+        if verbose > 0:
+            print(f" + Current sensor value: {current_value:.3f}", flush=True)
+
+        if current_value > sensor.threshold:
+            print(f" + Light detected! Value: {current_value:.3f}", flush=True)
+            record_pulse(conn)
+
+            # Wait for light to go dark
+            sensor.wait_for_dark()
+            print(f" + Light ended. Value: {sensor.value:.3f}", flush=True)
+        else:
+            # Small delay to prevent CPU overload
+            sensor.wait_for_light()
+
+except KeyboardInterrupt:
+    print(f"\n + Shutting down [{datetime.now()}]", flush=True)
+    scheduler.shutdown()
+    flush_pulses(DB_PATH)
+    checkpoint_wal(DB_PATH, "TRUNCATE")
+    conn.close()
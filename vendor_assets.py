@@ -0,0 +1,74 @@
+'''
+Vendor Chart Assets
+Downloads the chart and date picker libraries used by templates/detailed.html
+into static/vendor, so the dashboard works without internet access, and writes
+precompressed .gz (and .br, if the brotli package is installed) copies of every
+static file for web_view.py to serve.
+
+Run once on a machine with internet access, then copy the static folder to the Pi.
+Until a library is vendored the dashboard loads it from the pinned CDN URL below.
+Use --compress-only to regenerate the compressed copies after editing static files.
+'''
+
+import gzip
+import os
+import sys
+import urllib.request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# Pinned versions - change these deliberately, the file names are what the template uses
+VENDOR_ASSETS = {
+    "vendor/chart.umd.js": "https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js",
+    "vendor/moment.min.js": "https://cdn.jsdelivr.net/npm/moment@2.30.1/min/moment.min.js",
+    "vendor/chartjs-adapter-moment.min.js": "https://cdn.jsdelivr.net/npm/chartjs-adapter-moment@1.0.1/dist/chartjs-adapter-moment.min.js",
+    "vendor/hammer.min.js": "https://cdnjs.cloudflare.com/ajax/libs/hammer.js/2.0.8/hammer.min.js",
+    "vendor/chartjs-plugin-zoom.min.js": "https://cdn.jsdelivr.net/npm/chartjs-plugin-zoom@2.0.1/dist/chartjs-plugin-zoom.min.js",
+    "vendor/flatpickr.min.js": "https://cdn.jsdelivr.net/npm/flatpickr@4.6.13/dist/flatpickr.min.js",
+    "vendor/flatpickr.min.css": "https://cdn.jsdelivr.net/npm/flatpickr@4.6.13/dist/flatpickr.min.css",
+}
+
+# Only text formats benefit from compression
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.svg', '.json', '.txt', '.html')
+
+def download_assets():
+    """Fetch each pinned asset into the static folder"""
+    for filename, url in VENDOR_ASSETS.items():
+        path = os.path.join(STATIC_DIR, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f" + Downloading {url}", flush=True)
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+        with open(path, "wb") as f:
+            f.write(data)
+
+def compress_static():
+    """Write .gz and .br copies alongside every compressible static file"""
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+
+            # mtime=0 keeps the output identical between runs
+            with open(path + ".gz", "wb") as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli:
+                with open(path + ".br", "wb") as f:
+                    f.write(brotli.compress(data, quality=11))
+            print(f" + Compressed {os.path.relpath(path, STATIC_DIR)}", flush=True)
+
+    if not brotli:
+        print(" - brotli not installed, only .gz copies written", flush=True)
+
+if __name__ == '__main__':
+    if "--compress-only" not in sys.argv:
+        download_assets()
+    compress_static()
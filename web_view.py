@@ -1,14 +1,40 @@
-from flask import Flask, render_template, request
+from flask import Flask, current_app, render_template, request, send_from_directory, url_for
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
-from config.energy_rates import get_rates_for_date
+import gzip
+import hashlib
+import mimetypes
+import threading
+import time
+from collections import OrderedDict
+from config.web_config import load_config
+from energy_stats import create_stats_table
+from energy_data import (get_all_energy_data, create_snapshot_table, load_snapshot,
+                         load_rates, rates_version)
+from vendor_assets import VENDOR_ASSETS
 import re
-import json
 
-app = Flask(__name__)
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "energy.db")
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# Fingerprinted static URLs are safe to cache for a year
+STATIC_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'application/javascript', 'text/javascript', 'application/json')
+MIN_COMPRESS_SIZE = 500
+
+def init_db(db_path):
+    """Create the daily_stats and dashboard_snapshots tables if the monitor hasn't yet,
+    so page queries can rely on them"""
+    conn = sqlite3.connect(db_path)
+    create_stats_table(conn)
+    create_snapshot_table(conn)
+    conn.commit()
+    conn.close()
 
 def is_valid_date(date_string):
     """Validate that string matches YYYY-MM-DD format and is a valid date"""
@@ -26,161 +52,198 @@ def is_valid_date(date_string):
     except ValueError:
         return False
 
-def pulses_to_kwh(pulses):
-    return pulses / 3200
-
-def get_daily_energy_split(cursor, start_date, days_back=7):
-    """Get daily energy split between peak and off-peak hours"""
-    cursor.execute("""
-        SELECT 
-            strftime('%Y-%m-%d', hour_timestamp, 'localtime') as day,
-            SUM(CASE 
-                WHEN strftime('%H', hour_timestamp, 'localtime') >= '02' 
-                AND strftime('%H', hour_timestamp, 'localtime') < '09' 
-                THEN pulse_count ELSE 0 END) as off_peak_pulses,
-            SUM(CASE 
-                WHEN strftime('%H', hour_timestamp, 'localtime') < '02' 
-                OR strftime('%H', hour_timestamp, 'localtime') >= '09' 
-                THEN pulse_count ELSE 0 END) as peak_pulses
-        FROM hourly_pulses
-        WHERE date(hour_timestamp, 'localtime') 
-            BETWEEN date(?, ?) AND date(?)
-        GROUP BY day
-        ORDER BY day
-    """, (start_date, f'-{days_back} days', start_date))
-    
-    # Convert pulse counts to kWh before returning
-    raw_data = cursor.fetchall()
-    return [(day, pulses_to_kwh(off_peak), pulses_to_kwh(peak)) 
-            for day, off_peak, peak in raw_data]
-
-def get_all_energy_data(start_date=None):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    if not start_date:
-        start_date = datetime.now().strftime('%Y-%m-%d')
-
-    # Get minute data, hourly data, date range, and daily split in one connection
-    cursor.execute("""
-        WITH minute_data AS (
-            SELECT strftime('%Y-%m-%d %H:%M', timestamp, 'localtime') as minute,
-                   COUNT(*) as pulse_count
-            FROM pulses
-            WHERE date(timestamp, 'localtime') = ?
-            GROUP BY minute
-        ),
-        hourly_data AS (
-            SELECT strftime('%Y-%m-%d %H:00', hour_timestamp, 'localtime') as hour,
-                   pulse_count
-            FROM hourly_pulses
-            WHERE date(hour_timestamp, 'localtime') BETWEEN date(?, '-6 days') AND date(?)
-        ),
-        date_range AS (
-            SELECT MIN(date(timestamp)) as min_date, 
-                   MAX(date(timestamp)) as max_date 
-            FROM pulses
-        )
-        SELECT 
-            'minute' as type, minute as timestamp, pulse_count, NULL, NULL, NULL
-        FROM minute_data
-        UNION ALL
-        SELECT 
-            'hour' as type, hour, pulse_count, NULL, NULL, NULL
-        FROM hourly_data
-        UNION ALL
-        SELECT 
-            'range' as type, NULL, NULL, NULL, NULL, 
-            json_object('min', min_date, 'max', max_date)
-        FROM date_range;
-    """, (start_date, start_date, start_date))
-    
-    results = cursor.fetchall()
-    
-    # Get daily split using shared function - but extend it to get 7 days for detailed data
-    daily_split = get_daily_energy_split(cursor, start_date, 13)
-    
-    # Get detailed daily data with costs (7 days from start_date)
-    cursor.execute("""
-        SELECT 
-            strftime('%Y-%m-%d', hour_timestamp, 'localtime') as day,
-            SUM(CASE 
-                WHEN strftime('%H', hour_timestamp, 'localtime') >= '02' 
-                AND strftime('%H', hour_timestamp, 'localtime') < '09' 
-                THEN pulse_count ELSE 0 END) as off_peak_pulses,
-            SUM(CASE 
-                WHEN strftime('%H', hour_timestamp, 'localtime') < '02' 
-                OR strftime('%H', hour_timestamp, 'localtime') >= '09' 
-                THEN pulse_count ELSE 0 END) as peak_pulses,
-            SUM(pulse_count) as total_pulses
-        FROM hourly_pulses
-        WHERE date(hour_timestamp, 'localtime') 
-            BETWEEN date(?, '-13 days') AND date(?)
-        GROUP BY day
-        ORDER BY day
-    """, (start_date, start_date))
-    
-    detailed_daily_data = cursor.fetchall()
-    conn.close()
+def accepts_encoding(encoding):
+    """True if the client will accept a response in the given Content-Encoding"""
+    return request.accept_encodings[encoding] > 0
 
-    # Process results
-    minute_data = []
-    hourly_data = []
-    date_range = None
-
-    for row in results:
-        if row[0] == 'minute':
-            minute_data.append((row[1], row[2]))
-        elif row[0] == 'hour':
-            hourly_data.append((row[1], row[2]))
-        elif row[0] == 'range':
-            date_range = json.loads(row[5])
-
-    # Process detailed daily data with cost calculations
-    consolidated_data = []
-    for day_data in detailed_daily_data:
-        day, off_peak_pulses, peak_pulses, total_pulses = day_data
-        
-        # Get applicable rates for this day
-        date_obj = datetime.strptime(day, '%Y-%m-%d').date()
-        rates = get_rates_for_date(date_obj)
-        
-        # Calculate kWh values
-        off_peak_kwh = pulses_to_kwh(off_peak_pulses)
-        peak_kwh = pulses_to_kwh(peak_pulses)
-        total_kwh = pulses_to_kwh(total_pulses)
-        
-        # Standard rate calculations
-        standard_cost = (total_kwh * rates['standard']['unit_rate']/100) + (rates['standard']['standing_charge']/100)
-        
-        # EV Anytime calculations
-        ev_anytime_cost = (total_kwh * rates['ev_anytime']['unit_rate']/100) + (rates['ev_anytime']['standing_charge']/100)
-        
-        # Peak/Off-peak calculations
-        off_peak_cost = off_peak_kwh * rates['peak_offpeak']['offpeak_rate']/100
-        peak_cost = peak_kwh * rates['peak_offpeak']['peak_rate']/100
-        ev_day_night_cost = off_peak_cost + peak_cost + (rates['peak_offpeak']['standing_charge']/100)
-        
-        consolidated_data.append({
-            'date': day,
-            'off_peak_kwh': off_peak_kwh,
-            'peak_kwh': peak_kwh,
-            'standard_cost': standard_cost,
-            'ev_anytime_cost': ev_anytime_cost,
-            'ev_day_night_cost': ev_day_night_cost
-        })
-
-    return {
-        'minute_data': minute_data,
-        'minute_kwh': [(m[0], pulses_to_kwh(m[1])) for m in minute_data],
-        'hourly_data': hourly_data,
-        'hourly_kwh': [(h[0], pulses_to_kwh(h[1])) for h in hourly_data],
-        'daily_peak_split': daily_split,
-        'date_range': (date_range['min'], date_range['max']),
-        'consolidated_data': consolidated_data  # Add this to the return
-    }
+def hash_static_file(filename):
+    """Short content hash of a static file, or None if it doesn't exist"""
+    try:
+        with open(os.path.join(STATIC_DIR, filename), "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:12]
+    except OSError:
+        return None
+
+def hash_static_files():
+    """Content hashes for every static file (not the .gz/.br copies), keyed by URL path"""
+    hashes = {}
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            if name.endswith(('.gz', '.br')):
+                continue
+            filename = os.path.relpath(os.path.join(root, name), STATIC_DIR).replace(os.sep, '/')
+            hashes[filename] = hash_static_file(filename)
+    return hashes
+
+def asset_url(filename):
+    """URL for a static file with a content hash, so it can be cached indefinitely.
+    Libraries that haven't been vendored yet fall back to their pinned CDN URL."""
+    hashes = current_app.extensions['energy_monitor']['asset_hashes']
+    if filename not in hashes:
+        # Not there at startup - vendor_assets.py may have been run since
+        digest = hash_static_file(filename)
+        if digest is None:
+            return VENDOR_ASSETS.get(filename) or url_for('static', filename=filename)
+        hashes[filename] = digest
+    return url_for('static', filename=filename, v=hashes[filename])
+
+def static_file(filename):
+    """Serve a static file, using a precompressed .br or .gz copy when the client accepts it"""
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accepts_encoding(candidate) and os.path.isfile(os.path.join(STATIC_DIR, filename + suffix)):
+            encoding = candidate
+            filename = filename + suffix
+            break
+
+    # Only fingerprinted URLs are cached - anything else is revalidated each time
+    max_age = STATIC_MAX_AGE if request.args.get('v') else None
+    response = send_from_directory(STATIC_DIR, filename, mimetype=mimetype, max_age=max_age)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if max_age:
+        response.cache_control.immutable = True
+    return response
+
+def compress_response(response):
+    """Compress dynamic text responses - static files are already handled by static_file()"""
+    if (response.direct_passthrough
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    # Weak ETag of the uncompressed page, so an unchanged page costs a 304
+    # whichever encoding it was sent in
+    response.add_etag(weak=True)
+    response.make_conditional(request)
+    if response.status_code != 200:
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    if brotli and accepts_encoding('br'):
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepts_encoding('gzip'):
+        response.set_data(gzip.compress(data, compresslevel=6, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+class DashboardCache:
+    """Dashboard data per selected date, shared by the threads of one worker.
+    Holds at most max_entries dates, dropping the least recently used."""
+
+    def __init__(self, today_ttl, max_entries):
+        self.today_ttl = today_ttl
+        self.max_entries = max(max_entries, 1)
+        self.entries = OrderedDict()
+        self.day = None
+        self.lock = threading.Lock()
+
+    def get(self, selected_date, today):
+        """Cached data, or None if missing or stale"""
+        with self.lock:
+            # date_range and 'today' change at midnight, so start afresh
+            if self.day != today:
+                self.entries.clear()
+                self.day = today
+            entry = self.entries.get(selected_date)
+            if entry is not None:
+                self.entries.move_to_end(selected_date)
+        if entry is None:
+            return None
+        created, data = entry
+        if selected_date >= today and time.time() - created > self.today_ttl:
+            return None
+        return data
+
+    def put(self, selected_date, data):
+        with self.lock:
+            self.entries[selected_date] = (time.time(), data)
+            self.entries.move_to_end(selected_date)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def get_dashboard_data(selected_date):
+    """Dashboard data for a date - from the worker's cache, then the monitor's
+    snapshot, and only computed from the pulse tables when neither has it"""
+    state = current_app.extensions['energy_monitor']
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    data = state['cache'].get(selected_date, today)
+    if data is not None:
+        return data
+
+    data = load_snapshot(current_app.config['DB_PATH'], selected_date, state['rates_version'])
+    if data is not None:
+        # The date picker range is stored with the snapshot, but pulses have been
+        # recorded since a finished day's snapshot was taken
+        data['date_range'] = (data['date_range'][0], max(data['date_range'][1] or today, today))
+    else:
+        data = get_all_energy_data(selected_date, current_app.config['DB_PATH'],
+                                   state['rates'])
+    state['cache'].put(selected_date, data)
+    return data
+
+def warm_cache(app):
+    """Compute today and the previous warm_days days so the first visitors don't wait"""
+    with app.app_context():
+        today = datetime.now().date()
+        for days_back in range(app.config['WARM_DAYS'] + 1):
+            selected_date = (today - timedelta(days=days_back)).strftime('%Y-%m-%d')
+            try:
+                get_dashboard_data(selected_date)
+            except Exception as e:
+                # Best effort - the page will be computed on first request instead
+                app.logger.warning(f"Cache warmup failed for {selected_date}: {e}")
+                return
+        app.logger.info(f"Cache warmed for {today} and {app.config['WARM_DAYS']} days before")
+
+def start_cache_warmup(app):
+    """Warm the cache in the background so the worker can serve requests straight away"""
+    threading.Thread(target=warm_cache, args=(app,), daemon=True).start()
+
+def check_rates_file():
+    """Reload the tariffs if rates_file has changed, then rebuild the cache"""
+    state = current_app.extensions['energy_monitor']
+    now = time.time()
+    if now - state['rates_checked'] < current_app.config['RATES_CHECK_SECONDS']:
+        return
+    state['rates_checked'] = now
+
+    rates_file = current_app.config['RATES_FILE']
+    try:
+        mtime = os.path.getmtime(rates_file)
+    except OSError:
+        return
+    if mtime == state['rates_mtime']:
+        return
+    state['rates_mtime'] = mtime
+
+    try:
+        rates = load_rates(rates_file)
+        version = rates_version(rates, current_app.config['TIMEZONE'])
+    except Exception as e:
+        # Probably saved half way through an edit - keep serving the old tariffs
+        current_app.logger.error(f"Keeping previous tariffs, could not load {rates_file}: {e}")
+        return
+
+    state['rates'] = rates
+    state['rates_version'] = version
+    state['cache'].clear()
+    current_app.logger.info(f"Reloaded tariffs from {rates_file}")
+    start_cache_warmup(current_app._get_current_object())
 
-@app.route('/')
 def detailed():
     # Get and validate date parameter
     date_param = request.args.get('date')
@@ -190,7 +253,7 @@ def detailed():
     selected_date = date_param or datetime.now().strftime('%Y-%m-%d')
     
     # Get all data in one query - now includes consolidated_data
-    data = get_all_energy_data(selected_date)
+    data = get_dashboard_data(selected_date)
     
     return render_template('detailed.html',
                          minute_data=data['minute_data'],
@@ -200,7 +263,53 @@ def detailed():
                          hourly_kwh=data['hourly_kwh'],
                          selected_date=selected_date,
                          date_range=data['date_range'],
-                         consolidated_data=data['consolidated_data'])
+                         consolidated_data=data['consolidated_data'],
+                         daily_stats=data['daily_stats'])
     
+def create_app(config=None):
+    """Create the dashboard app from WEB_CONFIG, environment overrides and an optional dict"""
+    settings = load_config()
+    settings.update(config or {})
+
+    # SQLite's 'localtime' follows the process timezone
+    os.environ['TZ'] = settings['timezone']
+    if hasattr(time, 'tzset'):
+        time.tzset()
+
+    # Static files are served by static_file() so it can pick precompressed copies
+    app = Flask(__name__, static_folder=None)
+    app.config.update({key.upper(): value for key, value in settings.items()})
+
+    init_db(app.config['DB_PATH'])
+    rates = load_rates(app.config['RATES_FILE'])
+    app.extensions['energy_monitor'] = {
+        'rates': rates,
+        'rates_version': rates_version(rates, app.config['TIMEZONE']),
+        'rates_mtime': os.path.getmtime(app.config['RATES_FILE']),
+        'rates_checked': time.time(),
+        # Room for the warmed days plus a few others visitors browse to
+        'cache': DashboardCache(app.config['TODAY_CACHE_SECONDS'],
+                                max(app.config['WARM_DAYS'], 0) + 1 + app.config['CACHE_EXTRA_DAYS']),
+        'asset_hashes': hash_static_files(),
+    }
+
+    missing = [filename for filename in VENDOR_ASSETS
+               if filename not in app.extensions['energy_monitor']['asset_hashes']]
+    if missing:
+        app.logger.warning(f"Loading {', '.join(missing)} from the CDN - run vendor_assets.py "
+                           "to serve them locally")
+
+    app.add_template_global(asset_url)
+    app.add_url_rule('/static/<path:filename>', endpoint='static', view_func=static_file)
+    app.add_url_rule('/', view_func=detailed)
+    app.before_request(check_rates_file)
+    app.after_request(compress_response)
+
+    if app.config['WARM_DAYS'] >= 0:
+        start_cache_warmup(app)
+    return app
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    # Development server only - see wsgi.py for running under load
+    app = create_app()
+    app.run(host='0.0.0.0', port=5001, debug=app.config['DEBUG'], threaded=True)
@@ -0,0 +1,23 @@
+'''
+WSGI entry point for the Energy Monitor dashboard
+
+Runs the dashboard with several workers/threads instead of the single-threaded
+development server, so concurrent visitors don't queue behind each other.
+
+Gunicorn (2 workers with 4 threads each suits a Pi Zero):
+    pip install gunicorn
+    gunicorn --workers 2 --threads 4 --bind 0.0.0.0:5001 wsgi:app
+
+Waitress (pure Python, single process):
+    pip install waitress
+    waitress-serve --threads 8 --port 5001 wsgi:app
+
+Settings come from config/web_config.py and ENERGY_MONITOR_<SETTING> environment
+variables. Each worker warms its cache for today and the previous warm_days days
+on startup, and picks up changes to config/energy_rates.py without a restart.
+To restart gunicorn workers gracefully after a code change: kill -HUP <master pid>
+'''
+
+from web_view import create_app
+
+app = create_app()